@@ -479,7 +479,8 @@ def _get_live_context(db_path: str) -> str:
                 "SELECT title, status FROM goals WHERE status='active' ORDER BY created_at DESC LIMIT 3"
             ).fetchall()
             if goals:
-                parts.append(f"Active goals: {', '.join(f'"{g[\"title\"]}\"' for g in goals)}")
+                titles = ', '.join(f'"{g["title"]}"' for g in goals)
+                parts.append(f"Active goals: {titles}")
         except Exception:
             pass
 
@@ -1463,7 +1464,7 @@ def _route_deterministic(intent_data: Dict[str, Any], db_path: str) -> Optional[
         db_path = _get_db_path()
 
     try:
-        conn = sqlite3.connect(db_path, timeout=5)
+        conn = sqlite3.connect(db_path, timeout=5, uri=True)
         conn.row_factory = sqlite3.Row
 
         if intent == "spend_total":
@@ -12,12 +12,21 @@ Phase H: Learning from action_feedback — scores adjusted based on user's
   (< 30% confirm), de-weight email scores. If they always act (> 80%), boost.
 """
 
+import calendar
+import heapq
+import operator
 import sqlite3
 import time
 from typing import List, Dict, Any
 
 
 DAY = 86400
+_score_key = operator.itemgetter("score")
+
+
+def _month_start(year: int, month: int) -> int:
+    """Unix timestamp of 00:00 UTC on the 1st of the given month (same as strftime('%s', 'YYYY-MM-01'))."""
+    return calendar.timegm((year, month, 1, 0, 0, 0, 0, 0, 0))
 
 # Domain mapping from action_feedback.action_type → priority domain
 _ACTION_TO_DOMAIN = {
@@ -38,7 +47,8 @@ _ACTION_TO_DOMAIN = {
 
 
 def _open(db_path: str) -> sqlite3.Connection:
-    conn = sqlite3.connect(db_path)
+    # uri=True: plain paths are unaffected; "file:" URIs (in-memory test DBs) are honoured
+    conn = sqlite3.connect(db_path, uri=True)
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -118,11 +128,11 @@ def compute_priorities(db_path: str) -> Dict[str, Any]:
                 pass
         return {"priorities": [], "silence": True, "stats": {}, "error": str(e)}
 
-    priorities.sort(key=lambda p: p["score"], reverse=True)
-    silence = len(priorities) == 0 or priorities[0]["score"] < 40
+    top = heapq.nlargest(8, priorities, key=_score_key)
+    silence = not top or top[0]["score"] < 40
 
     return {
-        "priorities": priorities[:8],
+        "priorities": top,
         "silence": silence,
         "stats": stats,
         "generatedAt": int(time.time() * 1000),
@@ -240,21 +250,19 @@ def _collect_priorities(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
 
     # 6. Spending spike > 30% vs last month — base 55
     try:
-        import datetime
-        today = datetime.date.today()
-        this_month = today.replace(day=1).isoformat()
-        prev = today.replace(day=1)
-        last_month = (prev.replace(month=prev.month - 1) if prev.month > 1
-                      else prev.replace(year=prev.year - 1, month=12)).isoformat()
+        t = time.localtime(now)
+        this_month = _month_start(t.tm_year, t.tm_mon)
+        last_month = (_month_start(t.tm_year, t.tm_mon - 1) if t.tm_mon > 1
+                      else _month_start(t.tm_year - 1, 12))
 
         this_row = conn.execute(
             "SELECT COALESCE(SUM(amount_raw),0) as total FROM spend_log "
-            "WHERE occurred_at >= strftime('%s', ?)",
+            "WHERE occurred_at >= ?",
             (this_month,),
         ).fetchone()
         last_row = conn.execute(
             "SELECT COALESCE(SUM(amount_raw),0) as total FROM spend_log "
-            "WHERE occurred_at >= strftime('%s', ?) AND occurred_at < strftime('%s', ?)",
+            "WHERE occurred_at >= ? AND occurred_at < ?",
             (last_month, this_month),
         ).fetchone()
 
@@ -281,8 +289,8 @@ def _collect_priorities(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
 def _collect_stats(conn: sqlite3.Connection) -> Dict[str, Any]:
     now = int(time.time())
     try:
-        import datetime
-        today = datetime.date.today().replace(day=1).isoformat()
+        t = time.localtime(now)
+        month_start = _month_start(t.tm_year, t.tm_mon)
 
         task_count = conn.execute(
             "SELECT COUNT(*) as cnt FROM reminders WHERE completed = 0 AND archived_at IS NULL"
@@ -292,7 +300,7 @@ def _collect_stats(conn: sqlite3.Connection) -> Dict[str, Any]:
         ).fetchone()["cnt"]
         spend_row = conn.execute(
             "SELECT COALESCE(SUM(amount_raw),0) as total FROM spend_log "
-            "WHERE occurred_at >= strftime('%s', ?)", (today,)
+            "WHERE occurred_at >= ?", (month_start,)
         ).fetchone()
         month_spend = round(spend_row["total"]) if spend_row else 0
 
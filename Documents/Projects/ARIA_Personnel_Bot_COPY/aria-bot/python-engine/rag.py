@@ -17,12 +17,17 @@ Persistence:
     retriever.load_bm25(path)  # restore from disk on sidecar restart
 """
 
+import heapq
 import os
 import pickle
 import re
 import sys
+from collections import OrderedDict
 from typing import List, Dict, Any, Optional
 
+_WORD_RE = re.compile(r'\w+')
+_intern = sys.intern
+
 
 class HybridRetriever:
     """
@@ -30,11 +35,20 @@ class HybridRetriever:
     BM25 provides exact term matching, vectors provide semantic understanding.
     """
 
+    SCORE_CACHE_SIZE = 256  # distinct queries whose top BM25 hits are kept
+
     def __init__(self, vector_store):
         self._vs = vector_store
         self._bm25 = None
-        self._corpus_tokens: List[List[str]] = []
+        # Corpus stored as CSR-style term ids rather than List[List[str]]:
+        # doc i's tokens are _vocab[_term_ids[_indptr[i]:_indptr[i + 1]]]
+        self._vocab: List[str] = []
+        self._term_ids = None   # np.ndarray[int32], all docs concatenated
+        self._indptr = None     # np.ndarray[int32], len = n_docs + 1
         self._corpus_docs: List[Dict[str, Any]] = []
+        # LRU of (query, k, corpus_version) → (peak score, top-k hits); version bumps on build/load
+        self._corpus_version = 0
+        self._score_cache: "OrderedDict[tuple, Any]" = OrderedDict()
 
     def build_bm25_index(self, documents: List[Dict[str, Any]]) -> int:
         """
@@ -48,26 +62,49 @@ class HybridRetriever:
             print("[RAG] rank-bm25 not installed — BM25 disabled", file=sys.stderr)
             return 0
 
-        self._corpus_tokens = []
-        self._corpus_docs = []
+        vocab: Dict[str, int] = {}
+        indices: List[int] = []
+        indptr: List[int] = [0]
+        docs: List[Dict[str, Any]] = []
 
         for doc in documents:
             text = doc.get("text", "")
             tokens = self._tokenize(text)
             if tokens:
-                self._corpus_tokens.append(tokens)
-                self._corpus_docs.append(doc)
+                indices.extend([vocab.setdefault(t, len(vocab)) for t in tokens])
+                indptr.append(len(indices))
+                docs.append(doc)
 
-        if self._corpus_tokens:
-            self._bm25 = BM25Okapi(self._corpus_tokens)
-            print(f"[RAG] BM25 index built: {len(self._corpus_tokens)} documents",
+        self._set_corpus(list(vocab), indices, indptr, docs)
+
+        if self._corpus_docs:
+            self._bm25 = BM25Okapi(self._iter_corpus_tokens())
+            print(f"[RAG] BM25 index built: {len(self._corpus_docs)} documents",
                   file=sys.stderr)
 
-        return len(self._corpus_tokens)
+        return len(self._corpus_docs)
+
+    def _set_corpus(self, vocab, indices, indptr, docs) -> None:
+        """Store the corpus as int32 term-id / offset arrays plus the vocabulary."""
+        import numpy as np  # always present alongside rank-bm25
+        self._vocab = list(vocab)
+        self._term_ids = np.asarray(indices, dtype=np.int32)
+        self._indptr = np.asarray(indptr, dtype=np.int32)
+        self._corpus_docs = docs
+        self._corpus_version += 1
+        self._score_cache.clear()
+
+    def _iter_corpus_tokens(self):
+        """Yield each document's token list, decoded from the term-id arrays."""
+        vocab = self._vocab
+        term_ids = self._term_ids.tolist()
+        indptr = self._indptr.tolist()
+        for start, end in zip(indptr, indptr[1:]):
+            yield [vocab[t] for t in term_ids[start:end]]
 
     def save_bm25(self, path: str) -> bool:
         """
-        Persist the BM25 corpus (tokens + docs) to disk using pickle.
+        Persist the BM25 corpus (vocabulary, term-id arrays + docs) to disk using pickle.
         Call this after build_bm25_index() so the index survives sidecar restarts.
 
         Args:
@@ -75,16 +112,18 @@ class HybridRetriever:
         Returns:
             True if saved successfully, False otherwise.
         """
-        if not self._bm25 or not self._corpus_tokens:
+        if not self.bm25_ready:
             return False
         try:
             os.makedirs(os.path.dirname(path) if os.path.dirname(path) else '.', exist_ok=True)
             with open(path, 'wb') as f:
                 pickle.dump({
-                    'corpus_tokens': self._corpus_tokens,
+                    'vocab': self._vocab,
+                    'term_ids': self._term_ids,
+                    'indptr': self._indptr,
                     'corpus_docs': self._corpus_docs,
                 }, f, protocol=pickle.HIGHEST_PROTOCOL)
-            print(f"[RAG] BM25 index saved: {len(self._corpus_tokens)} docs → {path}", file=sys.stderr)
+            print(f"[RAG] BM25 index saved: {len(self._corpus_docs)} docs → {path}", file=sys.stderr)
             return True
         except Exception as e:
             print(f"[RAG] BM25 save error: {e}", file=sys.stderr)
@@ -93,7 +132,8 @@ class HybridRetriever:
     def load_bm25(self, path: str) -> bool:
         """
         Restore BM25 corpus from disk. Rebuilds the BM25Okapi object in-memory
-        from the pickled token corpus so search is immediately available.
+        from the pickled term-id corpus so search is immediately available.
+        Older pickles holding a raw 'corpus_tokens' list are converted on load.
 
         Args:
             path: Absolute path to the .pkl file
@@ -110,21 +150,54 @@ class HybridRetriever:
         try:
             with open(path, 'rb') as f:
                 data = pickle.load(f)
-            self._corpus_tokens = data.get('corpus_tokens', [])
-            self._corpus_docs   = data.get('corpus_docs', [])
-            if self._corpus_tokens:
-                self._bm25 = BM25Okapi(self._corpus_tokens)
-                print(f"[RAG] BM25 index loaded from disk: {len(self._corpus_tokens)} docs", file=sys.stderr)
+            docs = data.get('corpus_docs', [])
+            if 'corpus_tokens' in data:
+                vocab: Dict[str, int] = {}
+                indices: List[int] = []
+                indptr: List[int] = [0]
+                for tokens in data['corpus_tokens']:
+                    indices.extend([vocab.setdefault(t, len(vocab)) for t in tokens])
+                    indptr.append(len(indices))
+                self._set_corpus(list(vocab), indices, indptr, docs)
+            else:
+                self._set_corpus(data.get('vocab', []), data.get('term_ids', []),
+                                 data.get('indptr', [0]), docs)
+            if self._corpus_docs:
+                self._bm25 = BM25Okapi(self._iter_corpus_tokens())
+                print(f"[RAG] BM25 index loaded from disk: {len(self._corpus_docs)} docs", file=sys.stderr)
                 return True
             return False
         except Exception as e:
             print(f"[RAG] BM25 load error (will rebuild): {e}", file=sys.stderr)
             return False
 
+    def _bm25_top(self, query: str, k: int):
+        """
+        (peak score, [(doc index, score), ...] for the k best docs), or None if the
+        query has no tokens. Cached per (query, k, corpus_version) so repeated queries
+        skip tokenize + scoring; only the top-k hits are kept, not the full score array.
+        """
+        key = (query, k, self._corpus_version)
+        cache = self._score_cache
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        query_tokens = self._tokenize(query)
+        top = None
+        if query_tokens:
+            scores = self._bm25.get_scores(query_tokens)
+            best = heapq.nlargest(k, range(len(scores)), key=scores.__getitem__)
+            top = (float(scores.max()), [(idx, float(scores[idx])) for idx in best])
+        cache[key] = top
+        if len(cache) > self.SCORE_CACHE_SIZE:
+            cache.popitem(last=False)
+        return top
+
     @staticmethod
     def _tokenize(text: str) -> List[str]:
-        """Simple tokenization: lowercase, split on non-alphanumeric, filter short."""
-        return [w for w in re.split(r'\W+', text.lower()) if len(w) > 1]
+        """Simple tokenization: lowercase, split on non-alphanumeric, filter short.
+        Tokens are interned so repeated words share a single str object."""
+        return [_intern(w) for w in _WORD_RE.findall(text.lower()) if len(w) > 1]
 
     def hybrid_search(
         self,
@@ -159,37 +232,30 @@ class HybridRetriever:
                 doc_id = r.get("doc_id", f"v_{i}")
                 # ChromaDB cosine distance → similarity (lower distance = more similar)
                 similarity = max(0.0, 1.0 - r.get("distance", 1.0))
-                results[doc_id] = {
-                    **r,
-                    "vector_score": similarity,
-                    "bm25_score": 0.0,
-                    "vector_rank": i,
-                }
+                # query() returns fresh dicts, so annotate in place instead of copying
+                r["vector_score"] = similarity
+                r["bm25_score"] = 0.0
+                r["vector_rank"] = i
+                results[doc_id] = r
         except Exception as e:
             print(f"[RAG] Vector search error: {e}", file=sys.stderr)
 
         # ── 2. BM25 search (keyword matching) ──
-        if self._bm25 and self._corpus_tokens:
+        if self.bm25_ready:
             try:
-                query_tokens = self._tokenize(query)
-                if query_tokens:
-                    bm25_scores = self._bm25.get_scores(query_tokens)
-                    max_bm25 = max(bm25_scores) if max(bm25_scores) > 0 else 1.0
-
-                    # Get top-N BM25 results
-                    top_indices = sorted(
-                        range(len(bm25_scores)),
-                        key=lambda idx: bm25_scores[idx],
-                        reverse=True,
-                    )[:n_results * 2]
-
-                    for idx in top_indices:
-                        if bm25_scores[idx] <= 0:
+                # Get top-N BM25 results
+                bm25_top = self._bm25_top(query, n_results * 2)
+                if bm25_top is not None:
+                    peak, hits = bm25_top
+                    max_bm25 = peak if peak > 0 else 1.0
+
+                    for idx, score in hits:
+                        if score <= 0:
                             continue
 
                         doc = self._corpus_docs[idx]
                         doc_id = doc.get("doc_id", f"b_{idx}")
-                        normalized = bm25_scores[idx] / max_bm25
+                        normalized = score / max_bm25
 
                         # Apply doc_type filter if specified
                         if doc_type and doc.get("doc_type", "") != doc_type:
@@ -218,16 +284,14 @@ class HybridRetriever:
                 + bm25_weight * r.get("bm25_score", 0)
             )
 
-        # ── 4. Sort by combined score, return top-N ──
-        ranked = sorted(
+        # ── 4. Select top-N by combined score (O(N log K), no full sort) ──
+        return heapq.nlargest(
+            n_results,
             results.values(),
             key=lambda x: x["combined_score"],
-            reverse=True,
         )
 
-        return ranked[:n_results]
-
     @property
     def bm25_ready(self) -> bool:
         """Check if BM25 index is built."""
-        return self._bm25 is not None and len(self._corpus_tokens) > 0
+        return self._bm25 is not None and self._term_ids is not None and self._term_ids.size > 0
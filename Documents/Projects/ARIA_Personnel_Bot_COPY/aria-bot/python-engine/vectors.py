@@ -13,9 +13,68 @@ Features:
   - Type-filtered queries
 """
 
+import hashlib
+import heapq
+import json
 import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
 from typing import List, Dict, Any, Optional
 
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+def _env_int(name: str, default: int) -> int:
+    """Positive int from the environment; unset, malformed or < 1 falls back/clamps
+    so a bad setting can never break `import vectors` (agent/engine/rag import it)."""
+    try:
+        return max(1, int(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+
+# Shared keep-alive session for Ollama embed calls: batches reuse pooled
+# localhost connections instead of opening a new socket per request. The
+# /api/tags availability probe does not use it, so an Ollama that is down
+# fails fast instead of sitting through the retry backoff.
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.2),
+))
+
+# Embed sub-batches are posted concurrently; requests releases the GIL while
+# waiting on Ollama. Threads start lazily on first submit.
+_EMBED_POOL = ThreadPoolExecutor(
+    max_workers=_env_int("ARIA_EMBED_WORKERS", 2),
+    thread_name_prefix="aria-embed",
+)
+
+# batch_upsert hands each flush to this single writer so the next batch is
+# chunked and embedded while the previous one commits; one worker keeps
+# Chroma writes serialised and in order.
+_WRITE_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="aria-write")
+
+# One PersistentClient per absolute db_dir, shared by every VectorStore on
+# that directory so the SQLite handles and HNSW segments load only once.
+_CLIENT_CACHE: Dict[str, Any] = {}
+# Write counter per absolute db_dir; part of every query() cache key, so a write
+# through any VectorStore on that directory invalidates all of their caches.
+_QUERY_VERSIONS: Dict[str, int] = {}
+
+
+
+def _norm(text: str) -> str:
+    """NFKD-normalise text; ASCII is already in NFKD form, so skip the tables."""
+    return text if text.isascii() else unicodedata.normalize('NFKD', text)
+
 
 class VectorStore:
     """
@@ -27,6 +86,12 @@ class VectorStore:
     COLLECTION_NAME = "aria_docs"
     MAX_CHUNK_SIZE = 1500  # chars per chunk
     CHUNK_OVERLAP = 200    # overlap between chunks
+    PREVIEW_CHARS = 500    # chunk prefix kept in metadata and returned by query()
+    # texts per Ollama /api/embed request (32 suits CPU; raise for a GPU box)
+    EMBED_BATCH_SIZE = _env_int("ARIA_EMBED_BATCH", 32)
+    CHROMA_BATCH_SIZE = 250        # chunks per collection.upsert in batch_upsert
+    CHROMA_BATCH_BYTES = 4_000_000  # ...or fewer, once their text reaches this size
+    QUERY_CACHE_SIZE = 128          # distinct recent queries whose results are kept
 
     def __init__(self, db_dir: str = ""):
         if not db_dir:
@@ -35,8 +100,13 @@ class VectorStore:
 
         os.makedirs(db_dir, exist_ok=True)
         self._db_dir = db_dir
+        self._db_key = os.path.abspath(db_dir)  # _CLIENT_CACHE / _QUERY_VERSIONS key
         self._client = None
         self._collection = None
+        self._ef = None  # embedding function; batch_upsert calls its embed_documents()
+        # LRU of (text, n_results, doc_type, _QUERY_VERSIONS[db]) → query() results;
+        # the version bumps on every write so stale results are never served
+        self._query_cache: "OrderedDict[tuple, List[Dict[str, Any]]]" = OrderedDict()
 
     def _ensure(self):
         """Lazy-load chromadb on first use. Uses nomic-embed-text via Ollama if available."""
@@ -46,65 +116,266 @@ class VectorStore:
             import chromadb
             from chromadb import EmbeddingFunction, Documents, Embeddings
 
+            avail_cache_path = os.path.join(self._db_dir, ".nomic_avail.json")
+            embed_cache_path = os.path.join(self._db_dir, "embed_cache.sqlite")
+
             # ── Phase D: nomic-embed-text via Ollama ─────────────────────
             class NomicOllamaEF(EmbeddingFunction):
                 """Calls Ollama /api/embed with nomic-embed-text model."""
                 OLLAMA_EMBED_URL = "http://localhost:11434/api/embed"
                 MODEL = "nomic-embed-text"
+                AVAILABLE_TTL = 300  # seconds an on-disk availability result stays valid
+                CACHE_MAX_ROWS = 50_000  # embed_cache LRU cap; prune()'s default max_items
                 _available: Optional[bool] = None  # cached check
+                _default_ef = None  # ChromaDB default EF, built once on first fallback
+
+                def __init__(self):
+                    self._cache_conn = None
+                    self._cache_rows = 0  # row count, kept in step by _cache_put
+                    self._cache_lock = threading.Lock()
 
                 def name(self) -> str:
                     return "NomicOllamaEmbeddings"
 
+                def _cache(self) -> sqlite3.Connection:
+                    """Open the on-disk embedding cache on first use (caller holds the lock)."""
+                    if self._cache_conn is None:
+                        conn = sqlite3.connect(embed_cache_path, check_same_thread=False)
+                        conn.execute("PRAGMA journal_mode=WAL")
+                        conn.execute("PRAGMA synchronous=NORMAL")
+                        conn.execute(
+                            "CREATE TABLE IF NOT EXISTS embed_cache "
+                            "(hash BLOB PRIMARY KEY, dim INTEGER, vec BLOB, accessed_at REAL NOT NULL DEFAULT 0)"
+                        )
+                        columns = [row[1] for row in conn.execute("PRAGMA table_info(embed_cache)")]
+                        if "accessed_at" not in columns:  # caches created before the LRU cap
+                            conn.execute(
+                                "ALTER TABLE embed_cache ADD COLUMN accessed_at REAL NOT NULL DEFAULT 0")
+                        conn.execute(
+                            "CREATE INDEX IF NOT EXISTS idx_embed_cache_accessed ON embed_cache(accessed_at)")
+                        self._cache_rows = conn.execute("SELECT COUNT(*) FROM embed_cache").fetchone()[0]
+                        self._cache_conn = conn
+                    return self._cache_conn
+
+                def _cache_get(self, keys: List[bytes]) -> Dict[bytes, List[float]]:
+                    """Cached vectors for the given text hashes; misses are simply absent."""
+                    found: Dict[bytes, List[float]] = {}
+                    try:
+                        with self._cache_lock:
+                            conn = self._cache()
+                            for i in range(0, len(keys), 500):  # stay under SQLite's variable limit
+                                part = keys[i:i + 500]
+                                rows = conn.execute(
+                                    "SELECT hash, dim, vec FROM embed_cache WHERE hash IN (%s)"
+                                    % ",".join("?" * len(part)),
+                                    part,
+                                )
+                                for key, dim, blob in rows:
+                                    if len(blob) != 4 * dim:
+                                        continue  # float16 row from an older build: re-embed it
+                                    vec = array("f")
+                                    vec.frombytes(blob)
+                                    found[key] = vec.tolist()
+                            if found:
+                                hit_keys = list(found)
+                                now = time.time()
+                                with conn:
+                                    for i in range(0, len(hit_keys), 500):
+                                        part = hit_keys[i:i + 500]
+                                        conn.execute(
+                                            "UPDATE embed_cache SET accessed_at = ? WHERE hash IN (%s)"
+                                            % ",".join("?" * len(part)),
+                                            [now, *part],
+                                        )
+                    except sqlite3.Error:
+                        pass
+                    return found
+
+                def _cache_put(self, keys: List[bytes], embeddings: Embeddings) -> None:
+                    """
+                    Store freshly embedded vectors as float32 blobs, the precision
+                    Chroma indexes at, so a cache hit embeds a text exactly as a miss
+                    does. The table is an LRU: beyond CACHE_MAX_ROWS the least
+                    recently used rows go.
+                    """
+                    now = time.time()
+                    rows = [(key, len(vec), array("f", vec).tobytes(), now)
+                            for key, vec in zip(keys, embeddings)]
+                    try:
+                        with self._cache_lock:
+                            conn = self._cache()
+                            with conn:
+                                conn.executemany(
+                                    "INSERT OR REPLACE INTO embed_cache (hash, dim, vec, accessed_at) "
+                                    "VALUES (?, ?, ?, ?)",
+                                    rows,
+                                )
+                                self._cache_rows += len(rows)
+                                if self._cache_rows > self.CACHE_MAX_ROWS:
+                                    # the running count treats replaced rows as new: recount,
+                                    # then evict least recently used (rowid breaks ties in
+                                    # insert order)
+                                    self._cache_rows = conn.execute(
+                                        "SELECT COUNT(*) FROM embed_cache").fetchone()[0]
+                                    excess = self._cache_rows - self.CACHE_MAX_ROWS
+                                    if excess > 0:
+                                        conn.execute(
+                                            "DELETE FROM embed_cache WHERE rowid IN (SELECT rowid "
+                                            "FROM embed_cache ORDER BY accessed_at, rowid LIMIT ?)",
+                                            (excess,),
+                                        )
+                                        self._cache_rows -= excess
+                    except sqlite3.Error:
+                        pass
+
                 def _check_available(self) -> bool:
                     if NomicOllamaEF._available is not None:
                         return NomicOllamaEF._available
+                    # A recent positive result from a previous process skips the
+                    # /api/tags round-trip. Negatives are never trusted from disk: a
+                    # restart right after Ollama comes up would otherwise pin the
+                    # 384-d fallback onto a collection of 768-d nomic vectors.
                     try:
-                        import requests as _req
-                        tags = _req.get("http://localhost:11434/api/tags", timeout=2).json()
-                        models = [m.get("name", "") for m in tags.get("models", [])]
-                        NomicOllamaEF._available = any("nomic-embed-text" in m for m in models)
-                    except Exception:
-                        NomicOllamaEF._available = False
+                        with open(avail_cache_path, encoding="utf-8") as f:
+                            cached = json.load(f)
+                        if cached["available"] is True and time.time() - cached["ts"] < self.AVAILABLE_TTL:
+                            NomicOllamaEF._available = True
+                    except (OSError, ValueError, KeyError, TypeError):
+                        pass
+                    if NomicOllamaEF._available is None:
+                        try:
+                            tags = requests.get("http://localhost:11434/api/tags", timeout=2).json()
+                            models = [m.get("name", "") for m in tags.get("models", [])]
+                            NomicOllamaEF._available = any("nomic-embed-text" in m for m in models)
+                        except Exception:
+                            NomicOllamaEF._available = False
+                        if NomicOllamaEF._available:
+                            try:
+                                tmp_path = avail_cache_path + ".tmp"
+                                with open(tmp_path, "w", encoding="utf-8") as f:
+                                    json.dump({"available": True, "ts": time.time()}, f)
+                                os.replace(tmp_path, avail_cache_path)
+                            except OSError:
+                                pass
                     if NomicOllamaEF._available:
                         print("[VectorStore] Using nomic-embed-text for embeddings", flush=True)
                     else:
                         print("[VectorStore] nomic-embed-text not found — falling back to default embeddings", flush=True)
                     return NomicOllamaEF._available
 
+                def _embed(self, texts: List[str]) -> Embeddings:
+                    """POST one sub-batch to /api/embed; returns its embeddings in order."""
+                    resp = _SESSION.post(
+                        self.OLLAMA_EMBED_URL,
+                        json={"model": self.MODEL, "input": texts},
+                        timeout=30,
+                    )
+                    resp.raise_for_status()
+                    # Ollama returns {"embeddings": [[...], ...]}
+                    return resp.json().get("embeddings", [])
+
+                def _embed_adaptive(self, texts: List[str]) -> Embeddings:
+                    """Embed texts, halving the request size while Ollama times out or 5xx's."""
+                    batch_size = max(1, len(texts))
+                    embeddings: Embeddings = []
+                    start = 0
+                    while start < len(texts):
+                        sub = texts[start:start + batch_size]
+                        try:
+                            embeddings.extend(self._embed(sub))
+                        except requests.RequestException as e:
+                            overloaded = isinstance(e, requests.Timeout) or (
+                                e.response is not None and e.response.status_code >= 500)
+                            if not overloaded or batch_size == 1:
+                                raise
+                            batch_size //= 2
+                            continue
+                        start += len(sub)
+                    return embeddings
+
+                def _fallback(self, input: Documents) -> Embeddings:
+                    """Embed with ChromaDB's default (ONNX all-MiniLM-L6-v2), loading it only once."""
+                    if NomicOllamaEF._default_ef is None:
+                        from chromadb.utils import embedding_functions
+                        NomicOllamaEF._default_ef = embedding_functions.DefaultEmbeddingFunction()
+                    return NomicOllamaEF._default_ef(input)
+
                 def __call__(self, input: Documents) -> Embeddings:
+                    # Chroma calls this for query texts (and plain upserts): one-off
+                    # strings that would only grow the embedding cache
+                    return self._embed_texts(input, use_cache=False)
+
+                def embed_documents(self, input: Documents) -> Embeddings:
+                    """Embed batch_upsert chunks, reusing and filling the on-disk cache."""
+                    return self._embed_texts(input, use_cache=True)
+
+                def _embed_texts(self, input: Documents, use_cache: bool) -> Embeddings:
                     if not self._check_available():
-                        # Fallback: use ChromaDB default (ONNX all-MiniLM-L6-v2)
                         try:
-                            from chromadb.utils import embedding_functions
-                            default_ef = embedding_functions.DefaultEmbeddingFunction()
-                            return default_ef(input)
+                            return self._fallback(input)
                         except Exception:
                             raise RuntimeError("No embedding function available")
                     try:
-                        import requests as _req
-                        resp = _req.post(
-                            self.OLLAMA_EMBED_URL,
-                            json={"model": self.MODEL, "input": list(input)},
-                            timeout=30,
-                        )
-                        resp.raise_for_status()
-                        data = resp.json()
-                        # Ollama returns {"embeddings": [[...], ...]}
-                        return data.get("embeddings", [])
+                        # Repeated boilerplate (signatures, quoted replies) is embedded
+                        # once; inverse maps each input back to its unique text
+                        uniq: Dict[str, int] = {}
+                        inverse = [uniq.setdefault(t, len(uniq)) for t in input]
+                        texts = list(uniq)
+                        # Unchanged chunks are served from the content-addressed cache;
+                        # only the misses go to Ollama
+                        model = self.MODEL
+                        keys = [hashlib.sha1(f"{model}\x00{t}".encode("utf-8")).digest()
+                                for t in texts]
+                        cached = self._cache_get(keys) if use_cache else {}
+                        miss_keys = [k for k in keys if k not in cached]
+                        misses = [t for t, k in zip(texts, keys) if k not in cached]
+                        size = VectorStore.EMBED_BATCH_SIZE
+                        if len(misses) <= size:
+                            fresh = self._embed_adaptive(misses) if misses else []
+                        else:
+                            slices = [misses[i:i + size] for i in range(0, len(misses), size)]
+                            fresh = []
+                            # map() keeps slice order, so embeddings line up with misses
+                            for part in _EMBED_POOL.map(self._embed_adaptive, slices):
+                                fresh.extend(part)
+                        if len(fresh) != len(misses):
+                            raise ValueError(f"expected {len(misses)} embeddings, got {len(fresh)}")
+                        if fresh:
+                            if use_cache:
+                                # round to float32 like a later cache hit will be
+                                fresh = [array("f", vec).tolist() for vec in fresh]
+                                self._cache_put(miss_keys, fresh)
+                            cached.update(zip(miss_keys, fresh))
+                        embeddings = [cached[k] for k in keys]
+                        if len(texts) == len(inverse):
+                            return embeddings
+                        return [embeddings[i] for i in inverse]
                     except Exception as e:
                         print(f"[VectorStore] nomic embed error: {e} — falling back", flush=True)
                         NomicOllamaEF._available = False
-                        from chromadb.utils import embedding_functions
-                        default_ef = embedding_functions.DefaultEmbeddingFunction()
-                        return default_ef(input)
-
-            self._client = chromadb.PersistentClient(path=self._db_dir)
+                        return self._fallback(input)
+
+            self._ef = NomicOllamaEF()
+            self._client = _CLIENT_CACHE.get(self._db_key)
+            if self._client is None:
+                self._client = chromadb.PersistentClient(path=self._db_dir)
+                _CLIENT_CACHE[self._db_key] = self._client
+                # The Python sysdb (chromadb < 1.0) pools one SQLite connection per
+                # thread: tune the caller's (upsert/query) and the writer thread's
+                # (batch_upsert) handles. 1.x keeps SQLite inside its Rust
+                # bindings, where these pragmas cannot be reached.
+                if self._tune_sqlite(self._client):
+                    _WRITE_POOL.submit(self._tune_sqlite, self._client)
+                else:
+                    import sys
+                    print(f"[VectorStore] SQLite tuning skipped: chromadb "
+                          f"{getattr(chromadb, '__version__', '?')} has no Python sysdb",
+                          file=sys.stderr)
             try:
                 self._collection = self._client.get_or_create_collection(
                     name=self.COLLECTION_NAME,
                     metadata={"hnsw:space": "cosine"},
-                    embedding_function=NomicOllamaEF(),
+                    embedding_function=self._ef,
                 )
             except (ValueError, Exception) as _ef_err:
                 # Persisted collection has a different embedding function recorded.
@@ -121,40 +392,82 @@ class VectorStore:
                 self._collection = self._client.create_collection(
                     name=self.COLLECTION_NAME,
                     metadata={"hnsw:space": "cosine"},
-                    embedding_function=NomicOllamaEF(),
+                    embedding_function=self._ef,
                 )
         except ImportError:
             raise RuntimeError(
                 "chromadb is not installed. Run: pip install chromadb"
             )
 
+    @staticmethod
+    def _tune_sqlite(client) -> bool:
+        """
+        Relax fsync on Chroma's SQLite store: WAL + synchronous=NORMAL groups
+        commits instead of syncing every write. Applies to the calling thread's
+        pooled connection only, so run it on each thread that writes.
+        Only the legacy Python sysdb (chromadb < 1.0) exposes that pool;
+        returns False, leaving Chroma's defaults, when it is not there.
+        """
+        sysdb = getattr(getattr(client, "_server", None), "_sysdb", None)
+        pool = getattr(sysdb, "_conn_pool", None)
+        if pool is None:
+            return False
+        try:
+            conn = pool.connect()
+            try:
+                # journal_mode persists in the db file; the others are
+                # per-connection, so they only cover this thread's handle
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute("PRAGMA temp_store=MEMORY")
+                conn.execute("PRAGMA mmap_size=268435456")
+            finally:
+                pool.return_to_pool(conn)
+            return True
+        except Exception:
+            return False
+
     def _chunk_text(self, text: str) -> List[str]:
         """Split long text into overlapping chunks for better retrieval."""
-        if len(text) <= self.MAX_CHUNK_SIZE:
+        max_size, overlap = self.MAX_CHUNK_SIZE, self.CHUNK_OVERLAP
+        n = len(text)
+        if n <= max_size:
             return [text]
 
         chunks = []
+        # A boundary only counts past the chunk's midpoint, so search just that tail
+        min_break = int(max_size * 0.5) + 1
         start = 0
-        while start < len(text):
-            end = start + self.MAX_CHUNK_SIZE
-            chunk = text[start:end]
-
-            # Try to break at sentence boundary
-            if end < len(text):
-                last_period = chunk.rfind('. ')
-                last_newline = chunk.rfind('\n')
-                break_at = max(last_period, last_newline)
-                if break_at > self.MAX_CHUNK_SIZE * 0.5:
-                    chunk = chunk[:break_at + 1]
-                    end = start + break_at + 1
-
-            chunks.append(chunk.strip())
-            start = end - self.CHUNK_OVERLAP  # overlap for context continuity
+        while start < n:
+            end = start + max_size
+
+            # Try to break at sentence boundary (bounded rfind on text, no slice)
+            if end < n:
+                lo = start + min_break
+                break_at = max(text.rfind('. ', lo, end), text.rfind('\n', lo, end))
+                if break_at != -1:
+                    end = break_at + 1
+
+            chunks.append(text[start:end].strip())
+            start = end - overlap  # overlap for context continuity
             if start < 0:
                 start = 0
 
         return [c for c in chunks if c]
 
+    @staticmethod
+    def _base_meta(doc_type: str, doc_id: str, total_chunks: int,
+                   extra: Optional[Dict] = None) -> Dict[str, str]:
+        """
+        Metadata shared by every chunk of one document; callers copy() it per chunk.
+        extra values are stringified (None → ""), skipping str() for values that already are.
+        """
+        meta = {"type": doc_type, "doc_id": doc_id, "total_chunks": str(total_chunks)}
+        if extra:
+            for k, v in extra.items():
+                meta[k] = v if isinstance(v, str) else ("" if v is None else str(v))
+        return meta
+
     def upsert(self, doc_type: str, doc_id: str, text: str, extra_meta: Optional[Dict] = None) -> None:
         """
         Insert or update a document in the vector store.
@@ -164,31 +477,33 @@ class VectorStore:
         doc_id = str(doc_id) if doc_id is not None else ""
         doc_type = str(doc_type) if doc_type is not None else "doc"
 
-        import unicodedata
-        text = unicodedata.normalize('NFKD', text)
+        text = _norm(text)
         if not text.strip() or not doc_id:
             return
 
         self._ensure()
 
         chunks = self._chunk_text(text)
+        base_meta = self._base_meta(doc_type, doc_id, len(chunks), extra_meta)
 
-        for i, chunk in enumerate(chunks):
-            chunk_id = f"{doc_id}" if len(chunks) == 1 else f"{doc_id}__chunk{i}"
-            meta = {"type": doc_type, "doc_id": doc_id, "chunk_index": str(i), "total_chunks": str(len(chunks))}
-            if extra_meta:
-                for k, v in extra_meta.items():
-                    meta[k] = str(v) if v is not None else ""
+        try:
+            for i, chunk in enumerate(chunks):
+                chunk_id = f"{doc_id}" if len(chunks) == 1 else f"{doc_id}__chunk{i}"
+                meta = base_meta.copy()
+                meta.setdefault("chunk_index", str(i))  # extra_meta may override it
+                meta["preview"] = chunk[:self.PREVIEW_CHARS]
 
-            try:
-                self._collection.upsert(
-                    ids=[chunk_id],
-                    documents=[chunk[:2000]],
-                    metadatas=[meta],
-                )
-            except (TypeError, Exception) as e:
-                import sys
-                print(f"[VectorStore] Error in upsert: {e}, doc_id={repr(doc_id)}", file=sys.stderr)
+                try:
+                    self._collection.upsert(
+                        ids=[chunk_id],
+                        documents=[chunk[:2000]],
+                        metadatas=[meta],
+                    )
+                except (TypeError, Exception) as e:
+                    import sys
+                    print(f"[VectorStore] Error in upsert: {e}, doc_id={repr(doc_id)}", file=sys.stderr)
+        finally:
+            self._invalidate_queries()
 
     def batch_upsert(self, documents: List[Dict[str, Any]]) -> int:
         """
@@ -202,61 +517,93 @@ class VectorStore:
         self._ensure()
         indexed = 0
 
-        # Process in batches of 50 for ChromaDB efficiency
+        # Flush to ChromaDB every CHROMA_BATCH_SIZE chunks or CHROMA_BATCH_BYTES of
+        # text, whichever comes first. Each flush is embedded here, outside Chroma's
+        # write path (the embedding function splits it into EMBED_BATCH_SIZE
+        # requests), then double-buffered: at most one upsert is in flight on
+        # _WRITE_POOL while the next batch is built and embedded.
         batch_ids = []
         batch_docs = []
         batch_metas = []
+        batch_bytes = 0
+        pending = None
 
-        import unicodedata
+        def settle(pending) -> int:
+            future, size = pending
+            try:
+                future.result()
+                return size
+            except Exception as e:
+                import sys
+                print(f"[VectorStore] Batch error: {e}", file=sys.stderr)
+                return 0
 
-        for doc in documents:
-            text = str(doc.get("text", "")) if doc.get("text") else ""
-            text = unicodedata.normalize('NFKD', text)
-            doc_id = str(doc.get("doc_id", ""))
-            doc_type = str(doc.get("doc_type", "doc"))
+        def flush(pending):
+            """Embed the current batch while `pending` is still writing, then queue it.
+            Returns (chunks indexed by `pending`, the new pending write)."""
+            kwargs = {"ids": batch_ids, "documents": batch_docs, "metadatas": batch_metas}
+            if self._ef is not None:
+                try:
+                    kwargs["embeddings"] = self._ef.embed_documents(batch_docs)
+                except Exception as e:
+                    # leave it to the collection's own embedding function
+                    import sys
+                    print(f"[VectorStore] Batch embed error: {e}", file=sys.stderr)
+            done = settle(pending) if pending is not None else 0
+            return done, (_WRITE_POOL.submit(self._collection.upsert, **kwargs), len(batch_ids))
 
-            if not text.strip() or not doc_id:
-                continue
+        try:
+            for doc in documents:
+                # JSON-RPC callers already send strings, so only coerce when needed,
+                # and reject id-less rows before paying for normalisation
+                doc_id = doc.get("doc_id", "")
+                if not isinstance(doc_id, str):
+                    doc_id = str(doc_id)
+                if not doc_id:
+                    continue
+                text = doc.get("text") or ""
+                if not isinstance(text, str):
+                    text = str(text)
+                if not text.strip():
+                    continue
+                text = _norm(text)
+                doc_type = doc.get("doc_type", "doc")
+                if not isinstance(doc_type, str):
+                    doc_type = str(doc_type)
 
-            chunks = self._chunk_text(text)
-            for i, chunk in enumerate(chunks):
-                chunk_id = f"{doc_id}" if len(chunks) == 1 else f"{doc_id}__chunk{i}"
-                meta = {"type": doc_type, "doc_id": doc_id, "chunk_index": str(i), "total_chunks": str(len(chunks))}
+                chunks = self._chunk_text(text)
                 extra = doc.get("extra_meta")
-                if extra and isinstance(extra, dict):
-                    for k, v in extra.items():
-                        meta[k] = str(v) if v is not None else ""
-
-                batch_ids.append(chunk_id)
-                batch_docs.append(chunk[:2000])
-                batch_metas.append(meta)
-
-                # Flush every 50 items
-                if len(batch_ids) >= 50:
-                    try:
-                        self._collection.upsert(
-                            ids=batch_ids,
-                            documents=batch_docs,
-                            metadatas=batch_metas,
-                        )
-                        indexed += len(batch_ids)
-                    except Exception as e:
-                        import sys
-                        print(f"[VectorStore] Batch error: {e}", file=sys.stderr)
-                    batch_ids, batch_docs, batch_metas = [], [], []
-
-        # Flush remaining
-        if batch_ids:
-            try:
-                self._collection.upsert(
-                    ids=batch_ids,
-                    documents=batch_docs,
-                    metadatas=batch_metas,
-                )
-                indexed += len(batch_ids)
-            except Exception as e:
-                import sys
-                print(f"[VectorStore] Final batch error: {e}", file=sys.stderr)
+                base_meta = self._base_meta(doc_type, doc_id, len(chunks),
+                                            extra if isinstance(extra, dict) else None)
+                for i, chunk in enumerate(chunks):
+                    chunk_id = f"{doc_id}" if len(chunks) == 1 else f"{doc_id}__chunk{i}"
+                    meta = base_meta.copy()
+                    meta.setdefault("chunk_index", str(i))  # extra_meta may override it
+                    meta["preview"] = chunk[:self.PREVIEW_CHARS]
+
+                    doc_text = chunk[:2000]
+                    batch_ids.append(chunk_id)
+                    batch_docs.append(doc_text)
+                    batch_metas.append(meta)
+                    batch_bytes += len(doc_text)
+
+                    if len(batch_ids) >= self.CHROMA_BATCH_SIZE or batch_bytes >= self.CHROMA_BATCH_BYTES:
+                        done, pending = flush(pending)
+                        indexed += done
+                        batch_ids, batch_docs, batch_metas = [], [], []
+                        batch_bytes = 0
+
+            # Flush remaining, then wait for the last write
+            if batch_ids:
+                done, pending = flush(pending)
+                indexed += done
+            if pending is not None:
+                indexed += settle(pending)
+        finally:
+            # an aborted run may still have a write in flight; let it land first
+            if pending is not None:
+                wait([pending[0]])
+            self._invalidate_queries()
 
         return indexed
 
@@ -268,6 +615,11 @@ class VectorStore:
         if not text or not text.strip():
             return []
         text = str(text)
+        key = (text, n_results, doc_type, _QUERY_VERSIONS.get(self._db_key, 0))
+        cache = self._query_cache
+        if key in cache:
+            cache.move_to_end(key)
+            return self._copy_results(cache[key])
         self._ensure()
 
         where = {"type": doc_type} if doc_type else None
@@ -279,35 +631,61 @@ class VectorStore:
                 query_texts=[text],
                 n_results=min(n_results * 2, max(1, count)),  # fetch extra to handle chunk dedup
                 where=where,
-                include=["documents", "metadatas", "distances"],
+                # the text preview lives in metadata, so full documents stay in Chroma
+                include=["metadatas", "distances"],
             )
         except Exception:
             return []
 
         output = []
         seen_doc_ids = set()
+        legacy = {}  # chunk_id -> result still needing text (indexed before previews)
         if results and results.get("ids"):
-            ids = results["ids"][0]
-            docs = results["documents"][0]
-            metas = results["metadatas"][0]
-            dists = results["distances"][0]
-            for i, chunk_id in enumerate(ids):
-                doc_id = metas[i].get("doc_id", chunk_id)
+            seen_add = seen_doc_ids.add
+            output_append = output.append
+            for chunk_id, meta, dist in zip(results["ids"][0],
+                                            results["metadatas"][0],
+                                            results["distances"][0]):
+                doc_id = meta.get("doc_id", chunk_id)
                 # De-duplicate: only return best chunk per document
                 if doc_id in seen_doc_ids:
                     continue
-                seen_doc_ids.add(doc_id)
-                output.append({
+                seen_add(doc_id)
+                preview = meta.pop("preview", None)
+                entry = {
                     "doc_id": doc_id,
-                    "type": metas[i].get("type", ""),
-                    "text": docs[i][:500],
-                    "distance": dists[i],
-                    "metadata": metas[i],
-                })
+                    "type": meta.get("type", ""),
+                    "text": preview or "",
+                    "distance": dist,
+                    "metadata": meta,
+                }
+                if preview is None:
+                    legacy[chunk_id] = entry
+                output_append(entry)
                 if len(output) >= n_results:
                     break
+        if legacy:
+            try:
+                got = self._collection.get(ids=list(legacy), include=["documents"])
+                for chunk_id, doc in zip(got.get("ids", []), got.get("documents", [])):
+                    legacy[chunk_id]["text"] = (doc or "")[:self.PREVIEW_CHARS]
+            except Exception:
+                pass
+        cache[key] = self._copy_results(output)
+        if len(cache) > self.QUERY_CACHE_SIZE:
+            cache.popitem(last=False)
         return output
 
+    @staticmethod
+    def _copy_results(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Copy query() results so callers can annotate them without touching the cache."""
+        return [dict(r, metadata=dict(r["metadata"])) for r in results]
+
+    def _invalidate_queries(self) -> None:
+        """Drop cached query() results, here and on every store sharing this db_dir."""
+        _QUERY_VERSIONS[self._db_key] = _QUERY_VERSIONS.get(self._db_key, 0) + 1
+        self._query_cache.clear()
+
     def count(self) -> int:
         """Return total number of indexed documents/chunks."""
         try:
@@ -329,13 +707,18 @@ class VectorStore:
             count = self._collection.count()
             if count <= max_items:
                 return 0
-            # Fetch all IDs (no documents, just metadata) and sort
-            result = self._collection.get(include=[])
-            all_ids = sorted(result.get('ids', []))
-            excess = len(all_ids) - max_items
-            if excess <= 0:
-                return 0
-            to_delete = all_ids[:excess]
+            excess = count - max_items
+            # Stream IDs page by page (no documents or metadata) and keep only
+            # the `excess` lowest; Chroma's get() order is unspecified, so the
+            # oldest slice can't be fetched with limit/offset alone.
+            page_size = 5000
+
+            def _iter_ids():
+                for offset in range(0, count, page_size):
+                    page = self._collection.get(include=[], limit=page_size, offset=offset)
+                    yield from page.get('ids', [])
+
+            to_delete = heapq.nsmallest(excess, _iter_ids())
             # ChromaDB delete accepts at most 5461 IDs at a time
             batch_size = 5000
             deleted = 0
@@ -350,18 +733,17 @@ class VectorStore:
             import sys as _sys
             print(f"[VectorStore] Prune error: {e}", file=_sys.stderr)
             return 0
+        finally:
+            self._invalidate_queries()  # some batches may be gone even on error
 
     def delete(self, doc_id: str) -> None:
         """Remove a document (and all its chunks) from the index."""
         try:
             self._ensure()
-            # Delete exact ID
-            self._collection.delete(ids=[doc_id])
-            # Also delete any chunks
-            for i in range(20):  # max 20 chunks per doc
-                try:
-                    self._collection.delete(ids=[f"{doc_id}__chunk{i}"])
-                except Exception:
-                    break
+            # Every entry (whole doc or chunk) carries doc_id in its metadata,
+            # so one filtered delete removes them all in a single transaction.
+            self._collection.delete(where={"doc_id": str(doc_id)})
         except Exception:
             pass
+        finally:
+            self._invalidate_queries()